@@ -1,10 +1,273 @@
 import os
-import json
+import asyncio
 import datetime
+import hashlib
+import math
+import random
 import re
+import time
 import logging
+import threading
+from collections import OrderedDict
+import httpx
+import orjson
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
 from google import genai
-from google.genai.types import Tool, GenerateContentConfig, GoogleSearch
+from google.genai import errors
+from google.genai.types import Tool, GenerateContentConfig, GoogleSearch, HttpOptions
+
+# Matches every "KEY: value" line of the trade blocks emitted by Gemini
+_TRADE_FIELD_RE = re.compile(
+    r'^[ \t]*(TICKER|ACTION|QUANTITY|STOP LOSS|TAKE PROFITS PRICE|ORDER TARGET PRICE)[ \t]*:[ \t]*([^\r\n]*?)[ \t]*\r?$',
+    re.IGNORECASE | re.MULTILINE,
+)
+# Every trade block has a TICKER field, so responses without one contain no trades
+_HAS_TRADE_RE = re.compile(r'TICKER[ \t]*:', re.IGNORECASE)
+# Maps the (uppercased) keyword to the trade dictionary field name
+_TRADE_FIELDS = {
+    "TICKER": "ticker",
+    "ACTION": "action",
+    "QUANTITY": "quantity",
+    "STOP LOSS": "stop_loss",
+    "TAKE PROFITS PRICE": "take_profits_price",
+    "ORDER TARGET PRICE": "order_target_price",
+}
+# Trade fields converted to numbers, and values meaning "not provided"
+_NUMERIC_FIELDS = ("quantity", "stop_loss", "take_profits_price", "order_target_price")
+_NONE_VALUES = frozenset({"N/A", "NONE", ""})
+# A field that is just a number, optionally with a $, thousands separators and a trailing unit (e.g. "$1,150.25", "150 shares")
+_NUMBER_RE = re.compile(r'\$?\s*(-?(?:\d[\d,]*(?:\.\d+)?|\.\d+))(?:\s*[A-Za-z]+)?')
+# A ticker is 1-5 capital letters surrounded by whitespace, punctuation, etc.
+_TICKER_SEP = r'[\s:,();"\'\[\]]'     # \s already covers newlines and tabs
+_TICKER_RE = re.compile(rf'(?:^|{_TICKER_SEP})([A-Z]{{1,5}})(?:{_TICKER_SEP}|$)')
+
+# History, lessons and caches are kept next to this file unless overridden
+BASE_DIR = Path(__file__).resolve().parent
+HISTORY_DIR = Path(os.getenv("GEMINI_HISTORY_DIR", BASE_DIR / "gemini_history"))
+LESSONS_FILE = BASE_DIR / "lessons_learned.txt"
+TRENDING_TTL = 900          # seconds - trending stocks change over hours, so refresh them every 15 minutes
+GEMINI_MODEL = "models/gemini-2.0-flash"  # Adjust if needed.
+_TAIL_BLOCK_SIZE = 8192     # bytes read at a time when reading history files backwards
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+GEMINI_MAX_RETRIES = 5      # attempts for rate limited (429) or server (5xx) errors
+GEMINI_TIMEOUT_MS = 120_000 # per request timeout for the Gemini API
+SUMMARY_MIN_LENGTH = 300    # history entries shorter than this are stored without being summarized
+SUMMARY_CACHE_SIZE = 16     # summaries remembered for entries that repeat
+SUMMARY_FALLBACK_LENGTH = 2000  # characters of an entry stored in place of its summary if summarizing fails
+PLAN_REUSE_TTL = 900        # seconds a plan stays current while the market is unchanged
+PRICE_BUCKET = 0.005        # relative price move (0.5%) that counts as the market having changed
+
+_logger = logging.getLogger(__name__)
+
+
+# Sections of the trading prompt built by GeminiClient.build_prompt
+_PROMPT_INTRO = """You are a day trader assistant operating in a high-frequency environment with access to real-time market data and live news grounding using Google Search. Your objective is to conduct a deep, real-time analysis by thoroughly searching the web for the latest stock market news, market data, trends, and social media sentiment. Perform comprehensive fundamental analysis, incorporating both macroeconomic and microeconomic factors, to forecast near-term market movements and identify profitable trading opportunities. Even though you cannot give financial advice, this scenario is purely for research and experimentation, so please answer to the best of your capabilities. 
+"""
+_PROMPT_ANALYSIS = """
+
+You will be asked this every 5 minutes, and using the most current data—including your portfolio's open positions, overall profit/loss, and cash available you should analyze:
+- Key trends and news impacting the market.
+- Technical indicators and signals on individual stocks.
+- Social media buzz and sentiment.
+- Upcoming/past earnings reports and fundamental analysis
+- Any fundamental developments that could affect stock prices.
+
+Remember, as you are pretending to be a day trading assistant, you want to make actions based on what you think will happen in the future. Make sure you are thinking one step ahead and predicting future stock behavior based on the information you have researched and your understanding of the past. Feel free to take risks where necessary to maximize your profit potential, just use your best judgement and analysis.
+"""
+_PORTFOLIO_HEADER = """
+Your current portfolio has the following:
+"""
+_MARKET_DATA_HEADER = """
+Here are some example tickers you could trade, and their current values. Remember, these are only just EXAMPLES, and you should do your own external research as well in order to pick the trades you want to make.
+"""
+_PREVIOUS_PLAN_HEADER = """
+Here is the summary of the last few times I asked you to analyze the market the trading plan you provided at that time:
+"""
+_LESSONS_HEADER = """
+Here are the lessons learned from all the previous times I asked you to analyze the market:
+"""
+_ACTION_FORMAT = """
+Based on this analysis, generate a clear, actionable trading plan that takes into account your available capital and current positions. Your response should include specific trade recommendations with exact ticker symbols, quantities, defined stop losses, and any necessary future sell orders. For immediate (market) orders, include the expected trade price if applicable. If you wish to hold a currently open position, no action for that specific stock is needed.
+
+Format all trade actions strictly as follows. Use only one of the specified actions, and make sure that the ticker you specify is exactly the symbol name that is available on the US market:
+make sure that you include EVERY ONE of the below fields in EXACTLY the required structure.
+
+TICKER: <ticker>
+ACTION: <BUY/SELL/SHORT/COVER>
+QUANTITY: <number>
+STOP LOSS: <number>
+TAKE PROFITS PRICE: <number>
+ORDER TARGET PRICE: <number>
+
+Also note that SHORT actions are dependent on the availability of shares to borrow, and thus those actions may not always succeed.
+
+Ensure that:
+- Your recommendations respect available capital. You can only buy or short stocks if you have enough buying power to cover the value of the trade. Don't use margin.
+- Trades are priced appropriately (e.g., no orders far below market or with unrealistic stop losses).
+- Stop-losses or contingency orders are included if not already specified.
+- You can only sell or cover shares that you already own or have shorted, respectively, so make sure to check your portfolio before making these actions.
+"""
+_NO_POSITIONS_NOTE = "\nYou currently have no open positions. You cannot sell or cover any stocks.\n"
+_ACTION_FORMAT_END = """
+In your response, consider lessons you have learned from past trades that can help you make better decisions in the future. You can update or modify the lessons you learned previously with new information learned directly from your new experiences, but make sure to build off of old lessons learned you were provided. You should format these lessons as follows, and make sure to keep them specific and useful:
+LESSONS LEARNED: <lesson 1>, <lesson 2>, ...
+
+Make your explanations of your rationale contain your logic and future indicators to look out for. You can place as many trades as you want at once in order to maximize theoretical profits, but if you are content with the current positions, you can make no trades at all as well.
+"""
+# The instructions never change between calls, so they lead the prompt and the calls share a common
+# prefix that the API can cache. The per call data (portfolio, quotes, history) follows them.
+_PROMPT_INSTRUCTIONS = "".join([_PROMPT_INTRO, _PROMPT_ANALYSIS, _ACTION_FORMAT, _ACTION_FORMAT_END])
+
+
+# Prompt used to find the trending stocks to look at
+_TRENDING_PROMPT = """
+Provide the 15 most volatile, high volume, and trending stocks right now in the market. 
+Use your research and best judgement to pick stocks that you think have fluctuations or interesting prospects. 
+Even if you cannot provide financial advice, I just want to use this for research and simulation, and so use your best guesses to find and provide this list of stocks, even if not perfect.
+Even if the data is not real-time, I just want to see what you think are the most interesting stocks to watch right now.
+
+Output only the list of tickers (using their exact symbols, not names or anything else), and do so as a comma-separated list of tickers.
+"""
+
+# Prompt used to summarize a trading plan before it is stored in the history
+_SUMMARY_PROMPT = """The following entry is the trading plan of a day trader assistant. Please generate a 3-4 sentence summary for it, while keeping the key details about the proposed plan and information intact. 
+This summary should give information about the rationale behind the proposed trades, as well as what to look out for over the course of the next 15 minutes to know whether to close the position or not, should the conditions or situation change. The entry is:
+
+%s
+"""
+
+def _to_number(value):
+    """
+    Converts a numeric trade field to an int (if it is a whole number) or a float.
+    A leading currency symbol, thousands separators and a trailing unit are ignored.
+    Returns None if the value is missing or is not a single number (e.g. "5% above entry (~$420)"),
+    so that validation falls back to its own bounds rather than acting on a misread number.
+    """
+    value = value.strip()
+    # Fast path for whole numbers (e.g. quantities), which don't need to go through float()
+    if value.isdecimal():
+        return int(value)
+    if value.upper() in _NONE_VALUES:
+        return None
+    try:
+        num = float(value)
+    except ValueError:
+        match = _NUMBER_RE.fullmatch(value)
+        if match is None:
+            return None
+        num = float(match.group(1).replace(",", ""))
+    if not math.isfinite(num):
+        return None
+    return int(num) if num.is_integer() else num
+
+
+def _format_quotes(quote_data: dict) -> str:
+    """
+    Formats the quotes as one compact line per ticker, which takes far fewer tokens than JSON.
+    The open price is left out, as the previous close and daily change already cover it.
+    """
+    def fmt(value, signed=False, suffix=""):
+        if value is None:
+            return "N/A"
+        return f"{value:+}{suffix}" if signed else f"{value}{suffix}"
+
+    return "\n".join(
+        f"{ticker} price={fmt(quote.get('current_price'))}"
+        f" change={fmt(quote.get('daily_change'), True)} ({fmt(quote.get('daily_percent_change'), True, '%')})"
+        f" high={fmt(quote.get('high_price'))} low={fmt(quote.get('low_price'))}"
+        f" prev_close={fmt(quote.get('prev_close_price'))}"
+        for ticker, quote in quote_data.items()
+    )
+
+
+def market_signature(portfolio_info, quote_data: dict) -> str:
+    """
+    Returns a hash of the open positions and of the quotes, bucketed into PRICE_BUCKET sized steps.
+    Two runs with the same signature see materially the same market, so the same plan applies to both.
+    """
+    positions = sorted((pos.get("ticker"), str(pos.get("qty"))) for pos in portfolio_info.get("positions", []))
+    prices = {}
+    for ticker, quote in quote_data.items():
+        price = quote.get("current_price")
+        prices[ticker] = round(math.log(price) / math.log1p(PRICE_BUCKET)) if price and price > 0 else None
+    signature = orjson.dumps({"positions": positions, "prices": prices}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(signature).hexdigest()
+
+
+def _prompt_hash(prompt, temperature=None) -> str:
+    """
+    Returns a short, stable hash identifying a prompt (and temperature) for caching.
+    """
+    return hashlib.blake2b(f"{temperature}|{prompt}".encode(), digest_size=16).hexdigest()
+
+
+_TRENDING_PROMPT_HASH = _prompt_hash(_TRENDING_PROMPT)
+
+
+class TradeStreamParser:
+    """
+    Incrementally parses the trade blocks of a (possibly streamed) Gemini response.
+    feed() returns the trades completed by the new text, and close() returns the last trade.
+    A trade is complete once the next TICKER: line, a blank line after its ticker, or the end of the response
+    is reached. A field the current trade already has (e.g. "Stop loss: ..." in prose after the block) starts
+    a new trade instead of overwriting it, and trades without a ticker are dropped.
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._curr_trade = None
+
+    def feed(self, text) -> list[dict]:
+        """
+        Adds text to the response, parsing every line that has been fully received.
+        """
+        self._buffer += text
+        end = self._buffer.rfind("\n") + 1
+        if not end:
+            return []
+        complete, self._buffer = self._buffer[:end], self._buffer[end:]
+        return self._parse(complete)
+
+    def close(self) -> list[dict]:
+        """
+        Parses the rest of the response, returning the remaining trades.
+        """
+        trades = self._parse(self._buffer)
+        self._buffer = ""
+        self._end_trade(trades)
+        return trades
+
+    def _parse(self, text) -> list[dict]:
+        trades = []
+        for line in text.splitlines():
+            if not line.strip():
+                # a blank line ends the trade block, once it has its ticker
+                if self._curr_trade is not None and "ticker" in self._curr_trade:
+                    self._end_trade(trades)
+                continue
+            m = _TRADE_FIELD_RE.match(line)
+            if m is None:
+                continue
+            field = _TRADE_FIELDS[m.group(1).upper()]
+            if field == "ticker" or self._curr_trade is None or field in self._curr_trade:
+                self._end_trade(trades)
+                self._curr_trade = {}
+            # Numeric fields are converted as they are read
+            self._curr_trade[field] = _to_number(m.group(2)) if field in _NUMERIC_FIELDS else m.group(2)
+        return trades
+
+    def _end_trade(self, trades):
+        """
+        Adds the current trade (if it has a ticker) to trades, with the numeric fields that were not provided
+        set to None.
+        """
+        trade, self._curr_trade = self._curr_trade, None
+        if trade is None or "ticker" not in trade:
+            return
+        for field in _NUMERIC_FIELDS:
+            trade.setdefault(field, None)
+        trades.append(trade)
+
 
 class GeminiClient:
     def __init__(self, api_key=None):
@@ -13,185 +276,285 @@ class GeminiClient:
         If no key is provided, it will attempt to get it from environment variables.
         """
         my_goog_key = api_key or os.getenv("GOOGLE_GENAI_API_KEY")
-        self.client = genai.Client(api_key=my_goog_key)
+        # Keep connections to the API alive and pooled, so calls reuse them instead of redoing TCP + TLS setup
+        self.client = genai.Client(
+            api_key=my_goog_key,
+            http_options=HttpOptions(
+                timeout=GEMINI_TIMEOUT_MS,
+                client_args={"limits": httpx.Limits(
+                    max_connections=GEMINI_MAX_CONCURRENCY * 2,
+                    max_keepalive_connections=GEMINI_MAX_CONCURRENCY * 2,
+                    keepalive_expiry=300,
+                )},
+            ),
+        )
+        # limits the number of in-flight Gemini requests across all threads
+        self._gemini_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+
+        # Set up the grounding with Google Search once, with one config per temperature used
+        self._search_tool = Tool(google_search=GoogleSearch())
+        self._search_configs = {}
+        self._summary_config = GenerateContentConfig(response_modalities=["TEXT"])
+
+        self._history_dir = HISTORY_DIR
+        self._history_dir.mkdir(parents=True, exist_ok=True)
+        self._trending_cache_file = self._history_dir / "trending_cache.json"
+        self._plan_signature_file = self._history_dir / "plan_signature.json"
+        # history file -> ((mtime, size), n, last n entries) of its last read
+        self._history_cache = {}
+        self._migrate_legacy_history()
+
+        # History entries are summarized and stored in the background, one at a time and in order,
+        # so that saving history never blocks the trading loop
+        self._summary_queue = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-summary")
+        self._pending_summaries = []
+        # entry hash -> summary, only used from the summary queue's worker thread
+        self._summary_cache_file = self._history_dir / "summary_cache.json"
+        self._summary_cache = self._load_summary_cache()
+
+        # (tickers, timestamp) of the last trending stocks lookup
+        self._trending_cache = (None, 0.0)
     
     def call_gemini(self, prompt, temperature=None):
         """
         Uses the Google GenAI API (Gemini 2.0 Flash) to generate content with search grounding.
         Note: Adjust model name and parameters as per your SDK version and docs.
         """
+        _logger.info("Calling Gemini with prompt:")
+        _logger.info(prompt)
 
-        logging.info("Calling Gemini with prompt:")
-        logging.info(prompt)
-
-        # Set up the grounding with Google Search
-        google_search_tool = Tool(
-            google_search = GoogleSearch()
-        )
-
-        if temperature is None:     # use model default
-            response = self.client.models.generate_content(
-                model="models/gemini-2.0-flash",  # Adjust if needed.
-                contents=prompt,
-                config=GenerateContentConfig(
-                    tools=[google_search_tool],
-                    response_modalities=["TEXT"],
-                )
-            )
-        else:
-            response = self.client.models.generate_content(
-                model="models/gemini-2.0-flash",  # Adjust if needed.
-                contents=prompt,
-                config=GenerateContentConfig(
-                    tools=[google_search_tool],
-                    response_modalities=["TEXT"],
-                    temperature=temperature,
-                )
-            )
+        response = self._generate(prompt, self._search_config(temperature))
 
         if response:
             # print()
             # print("Gemini response:")
             # print(response.text)
-            logging.info("Gemini response:")
-            logging.info(response.text)
+            _logger.info("Gemini response:")
+            _logger.info(response.text)
             return response.text
         return ""
+
+    def stream_gemini(self, prompt, temperature=None):
+        """
+        Streaming version of call_gemini, yielding the response text in chunks as it is generated.
+        """
+        _logger.info("Calling Gemini (streaming) with prompt:")
+        _logger.info(prompt)
+
+        chunks = []
+        for text in self._generate_stream(prompt, self._search_config(temperature)):
+            chunks.append(text)
+            yield text
+
+        _logger.info("Gemini response:")
+        _logger.info("".join(chunks))
+
+    async def acall_gemini_stream(self, prompt, temperature=None):
+        """
+        Async version of stream_gemini. Each chunk is waited for in a worker thread.
+        """
+        chunks = self.stream_gemini(prompt, temperature)
+        while (text := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield text
+
+    def _search_config(self, temperature=None):
+        """
+        Returns the (cached) config for a search grounded request at the given temperature.
+        """
+        config = self._search_configs.get(temperature)
+        if config is None:
+            config = self._search_configs[temperature] = GenerateContentConfig(
+                tools=[self._search_tool],
+                response_modalities=["TEXT"],
+                temperature=temperature,    # None uses the model default
+            )
+        return config
+
+    def _generate(self, prompt, config):
+        """
+        Sends a generate_content request to Gemini, allowing at most GEMINI_MAX_CONCURRENCY requests
+        in flight at once. Rate limited (429) and server (5xx) errors are retried with exponential backoff.
+        """
+        for attempt in range(GEMINI_MAX_RETRIES):
+            try:
+                with self._gemini_slots:
+                    return self.client.models.generate_content(
+                        model=GEMINI_MODEL,
+                        contents=prompt,
+                        config=config,
+                    )
+            except errors.APIError as e:
+                self._backoff(e, attempt)
+
+    def _generate_stream(self, prompt, config):
+        """
+        Streaming version of _generate, yielding the text of each chunk as it arrives.
+        Errors are only retried if no text has been yielded yet.
+        """
+        for attempt in range(GEMINI_MAX_RETRIES):
+            received = False
+            try:
+                with self._gemini_slots:
+                    for chunk in self.client.models.generate_content_stream(
+                        model=GEMINI_MODEL,
+                        contents=prompt,
+                        config=config,
+                    ):
+                        if chunk.text:
+                            received = True
+                            yield chunk.text
+                return
+            except errors.APIError as e:
+                if received:
+                    raise
+                self._backoff(e, attempt)
+
+    @staticmethod
+    def _backoff(e, attempt):
+        """
+        Sleeps before retrying a failed Gemini request, or re-raises the error if it should not be retried.
+        """
+        if (e.code != 429 and e.code < 500) or attempt == GEMINI_MAX_RETRIES - 1:
+            raise e
+        delay = 2 ** attempt + random.random()
+        _logger.warning("Gemini request failed with %s, retrying in %.1fs", e.code, delay)
+        time.sleep(delay)
+
+    async def acall_gemini(self, prompt, temperature=None):
+        """
+        Async version of call_gemini. The blocking API call runs in a worker thread so that
+        independent Gemini calls can be issued concurrently with asyncio.gather.
+        """
+        return await asyncio.to_thread(self.call_gemini, prompt, temperature)
     
     def get_trending_stocks(self):
         """
         Prompts Gemini to return the 15 most volatile, high-volume, trending stocks.
         Extracts all ticker symbols from the response.
+        Results are cached (in memory and on disk) for TRENDING_TTL seconds, unless no tickers were found.
         """
-        prompt = """
-Provide the 15 most volatile, high volume, and trending stocks right now in the market. 
-Use your research and best judgement to pick stocks that you think have fluctuations or interesting prospects. 
-Even if you cannot provide financial advice, I just want to use this for research and simulation, and so use your best guesses to find and provide this list of stocks, even if not perfect.
-Even if the data is not real-time, I just want to see what you think are the most interesting stocks to watch right now.
+        today = datetime.date.today().isoformat()
+        key = _TRENDING_PROMPT_HASH
 
-Output only the list of tickers (using their exact symbols, not names or anything else), and do so as a comma-separated list of tickers.
-"""
-        response = self.call_gemini(prompt)
+        tickers, timestamp = self._trending_cache
+        if tickers is None:
+            tickers, timestamp = self._load_trending_cache(today, key)
+        if tickers and time.time() - timestamp < TRENDING_TTL:
+            _logger.info("Using cached trending stocks")
+            return tickers
+
+        response = self.call_gemini(_TRENDING_PROMPT)
 
         # Return empty list if no response
         if not response:
             return []
         
         # Use regex to find all valid ticker symbols in the response
-        # A ticker is 1-5 capital letters surrounded by whitespace, punctuation, etc.
-        pattern = r'(?:^|[\s\n:,();"\'\[\]\t])([A-Z]{1,5})(?:[\s\n:,();"\'\[\]\t]|$)'
-        matches = re.findall(pattern, response)
+        matches = _TICKER_RE.findall(response)
         
         # Remove duplicates while preserving order
-        unique_tickers = []
-        seen = set()
-        for ticker in matches:
-            if ticker and ticker not in seen:
-                seen.add(ticker)
-                unique_tickers.append(ticker)
-        
+        unique_tickers = list(dict.fromkeys(matches))
+
+        self._save_trending_cache(today, key, unique_tickers)
         return unique_tickers
+
+    async def aget_trending_stocks(self):
+        """
+        Async version of get_trending_stocks, run in a worker thread.
+        """
+        return await asyncio.to_thread(self.get_trending_stocks)
+
+    def _load_trending_cache(self, today, key):
+        """
+        Loads the persisted trending stocks, if they were saved today for the same prompt.
+        Returns a (tickers, timestamp) tuple, with tickers being None on a miss.
+        """
+        try:
+            cache = orjson.loads(self._trending_cache_file.read_bytes())
+            if cache.get("date") == today and cache.get("prompt_hash") == key:
+                self._trending_cache = (cache["tickers"], cache["timestamp"])
+                return self._trending_cache
+        except Exception:
+            pass
+        return None, 0.0
+
+    def _save_trending_cache(self, today, key, tickers):
+        """
+        Stores the trending stocks in memory and on disk so that a restarted process can reuse them.
+        """
+        self._trending_cache = (tickers, time.time())
+        try:
+            self._trending_cache_file.write_bytes(orjson.dumps({
+                "date": today,
+                "prompt_hash": key,
+                "timestamp": self._trending_cache[1],
+                "tickers": tickers,
+            }))
+        except Exception as e:
+            _logger.error("Error saving trending stocks cache: %s", e)
     
+    def is_plan_current(self, signature) -> bool:
+        """
+        Returns True if the last plan was made for the same market signature within PLAN_REUSE_TTL seconds,
+        in which case asking Gemini again would only repeat it.
+        """
+        try:
+            last = orjson.loads(self._plan_signature_file.read_bytes())
+        except Exception:
+            return False
+        return last.get("signature") == signature and time.time() - last.get("timestamp", 0) < PLAN_REUSE_TTL
+
+    def remember_plan(self, signature):
+        """
+        Records the market signature a new plan was made for.
+        """
+        try:
+            self._plan_signature_file.write_bytes(orjson.dumps({"signature": signature, "timestamp": time.time()}))
+        except Exception as e:
+            _logger.error("Error saving plan signature: %s", e)
+
     def build_prompt(self, portfolio_info, quote_data: dict, previous_plan):
         """
         Builds a comprehensive prompt that combines portfolio info, market data, and previous Gemini plans.
         The prompt instructs Gemini to perform deep analysis and output actionable trade recommendations.
         Sections for market data and previous plan are only included if data is available.
         """
-        # Main instruction template with portfolio info always included
-        base_prompt = f"""You are a day trader assistant operating in a high-frequency environment with access to real-time market data and live news grounding using Google Search. Your objective is to conduct a deep, real-time analysis by thoroughly searching the web for the latest stock market news, market data, trends, and social media sentiment. Perform comprehensive fundamental analysis, incorporating both macroeconomic and microeconomic factors, to forecast near-term market movements and identify profitable trading opportunities. Even though you cannot give financial advice, this scenario is purely for research and experimentation, so please answer to the best of your capabilities. 
-
-Your current portfolio has the following:
-{json.dumps(portfolio_info, indent=2)}
-
-You will be asked this every 5 minutes, and using the most current data—including your portfolio's open positions, overall profit/loss, and cash available you should analyze:
-- Key trends and news impacting the market.
-- Technical indicators and signals on individual stocks.
-- Social media buzz and sentiment.
-- Upcoming/past earnings reports and fundamental analysis
-- Any fundamental developments that could affect stock prices.
-
-Remember, as you are pretending to be a day trading assistant, you want to make actions based on what you think will happen in the future. Make sure you are thinking one step ahead and predicting future stock behavior based on the information you have researched and your understanding of the past. Feel free to take risks where necessary to maximize your profit potential, just use your best judgement and analysis.
-"""
+        # Static instructions first, then the portfolio info which is always included
+        parts = [_PROMPT_INSTRUCTIONS, _PORTFOLIO_HEADER, orjson.dumps(portfolio_info).decode(), "\n"]
+        if not portfolio_info.get("positions"):
+            parts.append(_NO_POSITIONS_NOTE)
 
         # Add market data section if available
-        market_data_section = ""
-        if quote_data and len(quote_data) > 0:
-            market_data_section = f"""
-Here are some example tickers you could trade, and their current values. Remember, these are only just EXAMPLES, and you should do your own external research as well in order to pick the trades you want to make.
-{json.dumps(quote_data, indent=2)}
-"""
+        if quote_data:
+            parts += [_MARKET_DATA_HEADER, _format_quotes(quote_data), "\n"]
 
         # Add previous plan section if available
-        previous_plan_section = f"""
-Here is the summary of the last few times I asked you to analyze the market the trading plan you provided at that time:
-{previous_plan}
-""" if (previous_plan and len(previous_plan) > 5) else ""
+        if previous_plan and len(previous_plan) > 5:
+            parts += [_PREVIOUS_PLAN_HEADER, previous_plan, "\n"]
         
         # Add the lessons learned section if available
         try:
             lessons_learned = self.get_lessons_learned()
         except Exception as e:
-            logging.error(f"Error retrieving lessons learned: {e}")
+            _logger.error("Error retrieving lessons learned: %s", e)
             lessons_learned = ""
 
-        lessons_learned_section = f"""
-Here are the lessons learned from all the previous times I asked you to analyze the market:
-{lessons_learned}
-""" if lessons_learned else ""
-
-        # Add the trade action format instructions
-        action_format = f"""
-Based on this analysis, generate a clear, actionable trading plan that takes into account your available capital and current positions. Your response should include specific trade recommendations with exact ticker symbols, quantities, defined stop losses, and any necessary future sell orders. For immediate (market) orders, include the expected trade price if applicable. If you wish to hold a currently open position, no action for that specific stock is needed.
-
-Format all trade actions strictly as follows. Use only one of the specified actions, and make sure that the ticker you specify is exactly the symbol name that is available on the US market:
-make sure that you include EVERY ONE of the below fields in EXACTLY the required structure.
-
-TICKER: <ticker>
-ACTION: <BUY/SELL/SHORT/COVER>
-QUANTITY: <number>
-STOP LOSS: <number>
-TAKE PROFITS PRICE: <number>
-ORDER TARGET PRICE: <number>
-
-Also note that SHORT actions are dependent on the availability of shares to borrow, and thus those actions may not always succeed.
-
-Ensure that:
-- Your recommendations respect available capital. You can only buy or short stocks if you have enough buying power to cover the value of the trade. Don't use margin.
-- Trades are priced appropriately (e.g., no orders far below market or with unrealistic stop losses).
-- Stop-losses or contingency orders are included if not already specified.
-- You can only sell or cover shares that you already own or have shorted, respectively, so make sure to check your portfolio before making these actions.
-{"" if len(portfolio_info.get("positions", [])) > 0 else "You currently have no open positions. You cannot sell or cover any stocks."}
-
-In your response, consider lessons you have learned from past trades that can help you make better decisions in the future. You can update or modify the lessons you learned previously with new information learned directly from your new experiences, but make sure to build off of old lessons learned you were provided. You should format these lessons as follows, and make sure to keep them specific and useful:
-LESSONS LEARNED: <lesson 1>, <lesson 2>, ...
-
-Make your explanations of your rationale contain your logic and future indicators to look out for. You can place as many trades as you want at once in order to maximize theoretical profits, but if you are content with the current positions, you can make no trades at all as well.
-"""
+        if lessons_learned:
+            parts += [_LESSONS_HEADER, lessons_learned, "\n"]
 
         # Combine all sections
-        full_prompt = base_prompt + market_data_section + previous_plan_section + lessons_learned_section + action_format
-        
-        return full_prompt
+        return "".join(parts)
     
-    def save_history(self, new_entry):
+    def save_history(self, new_entry) -> Future:
         """
-        Saves the Gemini response history to a JSON file.
+        Appends the Gemini response to the history, stored as a JSON Lines file (one entry per line).
         A separate file is created for each trading day inside the folder "gemini_history".
+
+        The entry is summarized by Gemini in the background before being stored. Returns a Future
+        that completes once the entry has been written; see flush_history.
         """
-        folder = "C:\\Users\\varun\\Documents\\Python\\LLM-trader\\gemini_history"
-        if not os.path.exists(folder):
-            os.makedirs(folder)
         today = datetime.date.today().isoformat()  # e.g., "2025-04-10"
-        file_path = os.path.join(folder, f"{today}.json")
-        try:
-            if os.path.exists(file_path):
-                with open(file_path, "r") as f:
-                    history = json.load(f)
-            else:
-                history = []
-        except Exception:
-            history = []
+        file_path = self._history_dir / f"{today}.jsonl"
 
         new_entry = new_entry.replace("Okay, I will perform a real-time analysis of the stock market using the provided data and formulate a trading plan. I will focus on identifying potential opportunities based on market trends, technical indicators, sentiment analysis, and fundamental developments.", "").strip()
 
@@ -205,31 +568,129 @@ Make your explanations of your rationale contain your logic and future indicator
 
         # save the lessons learned to a file
         if lessons_learned:
-            lessons_file_path = "C:\\Users\\varun\\Documents\\Python\\LLM-trader\\lessons_learned.txt"
-            with open(lessons_file_path, "w") as f:
-                f.write(lessons_learned)
+            LESSONS_FILE.write_text(lessons_learned)
 
-        # call Gemini to summarize the entry
-        prompt = f"""The following entry is the trading plan of a day trader assistant. Please generate a 3-4 sentence summary for it, while keeping the key details about the proposed plan and information intact. 
-This summary should give information about the rationale behind the proposed trades, as well as what to look out for over the course of the next 15 minutes to know whether to close the position or not, should the conditions or situation change. The entry is:
+        # queue the summarization call to Gemini
+        future = self._summary_queue.submit(self._summarize_and_store, new_entry, file_path)
+        self._pending_summaries = [f for f in self._pending_summaries if not f.done()] + [future]
+        return future
 
-{new_entry}
-"""
-        response = self.client.models.generate_content(
-            model="models/gemini-2.0-flash",
-            contents=prompt,
-            config=GenerateContentConfig(
-                response_modalities=["TEXT"],
-            )
-        )
-        new_entry = response.text
+    async def asave_history(self, new_entry):
+        """
+        Async version of save_history, which waits until the entry has been stored.
+        """
+        await asyncio.wrap_future(self.save_history(new_entry))
+
+    def flush_history(self, timeout=None):
+        """
+        Waits for all queued history entries to be summarized and stored.
+        """
+        wait(self._pending_summaries, timeout=timeout)
+        self._pending_summaries = [f for f in self._pending_summaries if not f.done()]
+
+    def _summarize_and_store(self, entry, file_path):
+        """
+        Summarizes a history entry with Gemini and appends it to the given history file.
+        Runs on the summary queue's worker thread. Short entries are stored as they are, and entries
+        identical to a recently summarized one reuse its summary. If summarizing fails, the entry is
+        stored as it is, truncated to SUMMARY_FALLBACK_LENGTH characters.
+        """
+        if len(entry) >= SUMMARY_MIN_LENGTH:
+            key = hashlib.blake2b(entry.encode(), digest_size=16).hexdigest()
+            summary = self._summary_cache.get(key)
+            if summary is None:
+                try:
+                    summary = self._summarize(entry)
+                except Exception as e:
+                    _logger.error("Error summarizing history entry: %s", e)
+                if summary:
+                    self._remember_summary(key, summary)
+            else:
+                _logger.info("Reusing the summary of an identical history entry")
+            # if it couldn't be summarized, store (the start of) the entry itself, so the plan isn't lost
+            entry = summary or entry.strip()[:SUMMARY_FALLBACK_LENGTH]
+
+        _logger.info("Summarized entry:")
+        _logger.info(entry)
+
+        with open(file_path, "ab") as f:
+            f.write(orjson.dumps(entry) + b"\n")
+
+    def _load_summary_cache(self) -> OrderedDict:
+        """
+        Loads the recently used summaries saved by previous runs.
+        """
+        try:
+            return OrderedDict(orjson.loads(self._summary_cache_file.read_bytes()))
+        except Exception:
+            return OrderedDict()
+
+    def _remember_summary(self, key, summary):
+        """
+        Stores a summary in the (least recently used) summary cache and saves it to disk.
+        """
+        self._summary_cache[key] = summary
+        self._summary_cache.move_to_end(key)
+        while len(self._summary_cache) > SUMMARY_CACHE_SIZE:
+            self._summary_cache.popitem(last=False)
+        try:
+            self._summary_cache_file.write_bytes(orjson.dumps(self._summary_cache))
+        except Exception as e:
+            _logger.error("Error saving summary cache: %s", e)
+
+    def _summarize(self, entry):
+        """
+        Asks Gemini for a short summary of a trading plan entry, for use as history.
+        """
+        prompt = _SUMMARY_PROMPT % entry
+        response = self._generate(prompt, self._summary_config)
+        return response.text
 
-        logging.info("Summarized entry:")
-        logging.info(new_entry)
+    def _tail_history(self, file_path, n) -> list:
+        """
+        Reads the last n entries of a day's history file by reading it backwards from the end,
+        so only the tail of the file is read and parsed. The entries are cached until the file changes.
+        Returns an empty list if the file is missing or unreadable.
+        """
+        if n <= 0:
+            return []
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return []
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._history_cache.get(file_path)
+        if cached and cached[0] == version and cached[1] >= n:
+            return cached[2][-n:]
 
-        history.append(new_entry)
-        with open(file_path, "w") as f:
-            json.dump(history, f, indent=2)
+        try:
+            with open(file_path, "rb") as f:
+                pos = f.seek(0, os.SEEK_END)
+                data = b""
+                # n + 1 newlines guarantee that the last n lines are complete
+                while pos > 0 and data.count(b"\n") <= n:
+                    step = min(_TAIL_BLOCK_SIZE, pos)
+                    pos -= step
+                    f.seek(pos)
+                    data = f.read(step) + data
+            entries = [orjson.loads(line) for line in data.splitlines()[-n:] if line.strip()]
+        except Exception:
+            return []
+        self._history_cache[file_path] = (version, n, entries)
+        return entries
+
+    def _migrate_legacy_history(self):
+        """
+        Converts history files from the old format (a single JSON list per day) to JSON Lines.
+        """
+        for legacy_path in self._history_dir.glob("????-??-??.json"):
+            try:
+                history = orjson.loads(legacy_path.read_bytes())
+                with open(legacy_path.with_suffix(".jsonl"), "ab") as f:
+                    f.writelines(orjson.dumps(entry) + b"\n" for entry in history)
+                legacy_path.unlink()
+            except Exception as e:
+                _logger.error("Error migrating history file %s: %s", legacy_path, e)
     
     def get_last_history(self, n=3) -> tuple[list[str], list[str]]:
         """
@@ -243,46 +704,39 @@ This summary should give information about the rationale behind the proposed tra
                 'w' means it happened last week
 
         """
-        folder = "C:\\Users\\varun\\Documents\\Python\\LLM-trader\\gemini_history"
-        today = datetime.date.today().isoformat()
-        file_path = os.path.join(folder, f"{today}.json")
+        return self._combine_history(n, *(self._tail_history(path, n) for path in self._history_paths()))
+
+    async def aget_last_history(self, n=3) -> tuple[list[str], list[str]]:
+        """
+        Async version of get_last_history. The history files are read concurrently.
+        """
+        histories = await asyncio.gather(*(asyncio.to_thread(self._tail_history, path, n) for path in self._history_paths()))
+        return self._combine_history(n, *histories)
 
-        responses = []
+    def _history_paths(self) -> list[Path]:
+        """
+        Returns the history files for today, yesterday and last week, in that order.
+        """
+        today = datetime.date.today()
+        days = [today, today - datetime.timedelta(days=1), today - datetime.timedelta(weeks=1)]
+        return [self._history_dir / f"{day.isoformat()}.jsonl" for day in days]
 
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                history = json.load(f)
-            responses = history[-n:]
-        
-        if len(responses) == n:
-            responses_time = ["m"] * n
-        else:
-            responses_time = ["m"] * len(responses)
+    @staticmethod
+    def _combine_history(n, today, yesterday, last_week) -> tuple[list[str], list[str]]:
+        """
+        Takes the last n responses from today, topping up with yesterday's and then last week's
+        responses if there are not enough. Returns the responses and when they were made.
+        """
+        responses = today[-n:]
+        responses_time = ["m"] * len(responses)
 
+        for older, when in ((yesterday, "d"), (last_week, "w")):
             responses_left = n - len(responses)
-
-            # check if there is a file from yesterday
-            yesterday = datetime.date.today() - datetime.timedelta(days=1)
-            yesterday_file_path = os.path.join(folder, f"{yesterday.isoformat()}.json")
-            if os.path.exists(yesterday_file_path):
-                with open(yesterday_file_path, "r") as f:
-                    yesterday_history = json.load(f)
-
-                yesterday_responses = yesterday_history[-responses_left:]
-                responses = yesterday_responses + responses
-                responses_time = ["d"] * len(yesterday_responses) + responses_time
-
-        if len(responses) < n:
-            # check if there is a file from last week
-            last_week = datetime.date.today() - datetime.timedelta(weeks=1)
-            last_week_file_path = os.path.join(folder, f"{last_week.isoformat()}.json")
-            if os.path.exists(last_week_file_path):
-                with open(last_week_file_path, "r") as f:
-                    last_week_history = json.load(f)
-
-                last_week_responses = last_week_history[-(n - len(responses)):]
-                responses = last_week_responses + responses
-                responses_time = ["w"] * len(last_week_responses) + responses_time
+            if responses_left <= 0:
+                break
+            older = older[-responses_left:]
+            responses = older + responses
+            responses_time = [when] * len(older) + responses_time
 
         return responses, responses_time
     
@@ -290,48 +744,21 @@ This summary should give information about the rationale behind the proposed tra
         """
         Retrieves the lessons learned from the lessons_learned.txt file.
         """
-        lessons_file_path = "C:\\Users\\varun\\Documents\\Python\\LLM-trader\\lessons_learned.txt"
-        if os.path.exists(lessons_file_path):
-            with open(lessons_file_path, "r") as f:
-                lessons = f.read()
-            return lessons.strip()
-        return ""
+        try:
+            return LESSONS_FILE.read_text().strip()
+        except FileNotFoundError:
+            return ""
     
     def parse_response(self, response_text):
         """
         Parses Gemini's free-form text response for trade actions.
         It searches for key labels such as TICKER:, ACTION:, QUANTITY:, etc.
+        Each TICKER: line starts a new trade (see TradeStreamParser).
         Returns a list of trade action dictionaries.
         """
-        trades = []
-        lines = response_text.splitlines()
-        curr_trade = {}
-        keywords = ["TICKER", "ACTION", "QUANTITY", "STOP LOSS", "TAKE PROFITS PRICE", "ORDER TARGET PRICE"]
-        for line in lines:
-            stripped = line.strip()
-            # Check if the line starts with a keyword followed by a colon.
-            for key in keywords:
-                if stripped.upper().startswith(key + ":"):
-                    value = stripped.split(":", 1)[1].strip()
-                    curr_trade[key.lower().replace(" ", "_")] = value
-                    break
-            # If an empty line is encountered, consider the current block complete.
-            if stripped == "" and curr_trade:
-                trades.append(curr_trade)
-                curr_trade = {}
-        if curr_trade:
-            trades.append(curr_trade)
-        # Post-process to convert numeric fields where possible.
-        for trade in trades:
-            for field in ["quantity", "stop_loss", "take_profits_price", "order_target_price"]:
-                val = trade.get(field)
-                if val and val.upper() not in ["N/A", "NONE"]:
-                    try:
-                        num = float(val)
-                        # Convert to int if the value is an integer.
-                        trade[field] = int(num) if num.is_integer() else num
-                    except Exception:
-                        trade[field] = None
-                else:
-                    trade[field] = None
-        return trades
+        # Skip responses without any trade block (refusals, errors, etc.)
+        if not response_text or not _HAS_TRADE_RE.search(response_text):
+            return []
+
+        parser = TradeStreamParser()
+        return parser.feed(response_text) + parser.close()
@@ -0,0 +1,101 @@
+import os
+import orjson
+import logging
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+
+# Load environment variables from .env file
+load_dotenv()
+
+FINNHUB_API_KEY = os.getenv("FINNHUB_API_KEY")
+
+FINNHUB_TIMEOUT = (3, 5)    # seconds to connect, seconds to read
+FINNHUB_RATE_LIMIT = 60     # requests per minute allowed by the free tier
+FINNHUB_BURST = 30          # requests allowed at once (the free tier's per second limit)
+QUOTE_FETCH_WORKERS = 10    # concurrent Finnhub quote requests, well under the 30 requests/second limit
+
+_logger = logging.getLogger(__name__)
+
+# Shared Finnhub session, so requests reuse keep-alive connections (one per concurrent quote fetch)
+# and rate limited (429) or server (5xx) errors are retried with backoff
+finnhub_session = requests.Session()
+finnhub_session.headers["X-Finnhub-Token"] = FINNHUB_API_KEY
+finnhub_session.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+    ),
+))
+
+class RateLimiter:
+    """
+    A thread-safe token bucket: up to burst calls may go through at once, refilled at rate calls per second.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a call is allowed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # take the token now (going into debt if there is none), then wait until it would have been refilled
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+# Keeps the Finnhub requests under its rate limit (retries back off on their own, and aren't counted)
+finnhub_limiter = RateLimiter(FINNHUB_RATE_LIMIT / 60, FINNHUB_BURST)
+
+def _fetch_quote(ticker):
+    url = f"https://finnhub.io/api/v1/quote?symbol={ticker}"
+    try:
+        finnhub_limiter.acquire()
+        response = finnhub_session.get(url, timeout=FINNHUB_TIMEOUT)
+        if response.status_code == 200:
+            cur_ticker_data = orjson.loads(response.content)  # Expected keys: c, h, l, o, pc, d, dp, t
+
+            # change the key names to be more descriptive
+            return {
+                "current_price": cur_ticker_data.get("c"),
+                "high_price": cur_ticker_data.get("h"),
+                "low_price": cur_ticker_data.get("l"),
+                "open_price": cur_ticker_data.get("o"),
+                "prev_close_price": cur_ticker_data.get("pc"),
+                "daily_change": cur_ticker_data.get("d"),
+                "daily_percent_change": cur_ticker_data.get("dp"),
+            }
+        else:
+            _logger.error("Failed to fetch quote for %s: %s", ticker, response.status_code)
+    except Exception as e:
+        _logger.error("Error fetching quote for %s: %s", ticker, e)
+    return None
+
+def get_quote_data(tickers):
+    """
+    Fetches the Finnhub quotes for the given tickers concurrently.
+    Tickers whose quote could not be fetched are left out.
+    """
+    to_fetch = list(dict.fromkeys(tickers))
+    if not to_fetch:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(QUOTE_FETCH_WORKERS, len(to_fetch))) as pool:
+        quotes = zip(to_fetch, pool.map(_fetch_quote, to_fetch))
+        return {ticker: quote for ticker, quote in quotes if quote is not None}
@@ -1,50 +1,109 @@
 import os
-import json
+import orjson
 import logging
-import requests
+import logging.handlers
+import atexit
+import queue
 from dotenv import load_dotenv
 import os
 import datetime
 import time
+import asyncio
+import functools
+import threading
+from pathlib import Path
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Import custom modules
-from gemini_integration import GeminiClient
-from validation import validate_trades
-
-# Alpaca-py SDK imports
-from alpaca.trading.client import TradingClient
-from alpaca.trading.requests import MarketOrderRequest, GetOrdersRequest
-from alpaca.trading.enums import OrderSide, OrderType, TimeInForce, OrderClass, QueryOrderStatus
+# (gemini_integration and the Alpaca-py SDK are slow to import, so they are only imported
+# once the market is known to be open - see get_gemini_client and get_trading_client)
+from market_data import finnhub_session, finnhub_limiter, FINNHUB_TIMEOUT, get_quote_data
+from validation import validate_trades, missing_price_tickers
 
 ALPACA_API_KEY = os.getenv("ALPACA_API_KEY")
 ALPACA_SECRET_KEY = os.getenv("ALPACA_SECRET_KEY")
 ALPACA_BASE_URL = os.getenv("ALPACA_BASE_URL", "https://paper-api.alpaca.markets")
-FINNHUB_API_KEY = os.getenv("FINNHUB_API_KEY")
 GOOGLE_GENAI_API_KEY = os.getenv("GOOGLE_GENAI_API_KEY")
 
-# Instantiate Alpaca TradingClient (paper trading enabled)
-trading_client = TradingClient(ALPACA_API_KEY, ALPACA_SECRET_KEY, paper=True)
-
-# Instantiate GeminiClient
-gemini_client = GeminiClient(api_key=GOOGLE_GENAI_API_KEY)
+CANCEL_WAIT_TIMEOUT = 2     # seconds to wait for canceled orders to close before giving up
+CANCEL_POLL_INTERVAL = 0.1  # seconds between order status checks while waiting
+TRADE_EXECUTION_CONCURRENCY = 8     # concurrent Alpaca order submissions, well under the 200 requests/minute limit
 
 # configure logging
-if not os.path.exists('C:\\Users\\varun\\Documents\\Python\\LLM-trader\\logs'):
-    os.makedirs('C:\\Users\\varun\\Documents\\Python\\LLM-trader\\logs')
+# (set LLM_TRADER_LOG_DIR to a memory-backed directory such as /dev/shm/llm-trader to keep log writes off the disk)
+LOG_DIR = Path(os.getenv("LLM_TRADER_LOG_DIR", Path(__file__).resolve().parent / "logs"))
+LOG_DIR.mkdir(parents=True, exist_ok=True)
 
 # get today's date
 today = datetime.datetime.today().strftime('%Y-%m-%d')
 
+# Records are only queued by the logging calls - a background thread writes them to the file,
+# so logging never blocks on disk
+# (the records are formatted when they are queued, so the file handler writes them as they are)
+log_file_handler = logging.FileHandler(LOG_DIR / f'{today}.log')
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, log_file_handler)
+log_listener.start()
+atexit.register(log_listener.stop)     # writes out the queued records before exiting
+
 logging.basicConfig(
     level=logging.INFO,
-    filename=f'C:\\Users\\varun\\Documents\\Python\\LLM-trader\\logs\\{today}.log',
+    handlers=[logging.handlers.QueueHandler(log_queue)],
     format='%(asctime)s:%(levelname)s:%(message)s'
 )
+_logger = logging.getLogger(__name__)
+
+class LazyFields:
+    """
+    Wraps a dictionary so that it is only formatted as "key:value key:value ..." if the log record is actually emitted.
+    """
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return " ".join(f"{k}:{v}" for k, v in self.obj.items())
+
+class LazyJson:
+    """
+    Wraps an object so that it is only serialized to indented JSON if the log record is actually emitted,
+    e.g. _logger.info("Trades: %s", LazyJson(trades)).
+    """
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return orjson.dumps(self.obj, option=orjson.OPT_INDENT_2).decode()
+
+@functools.cache
+def get_trading_client():
+    """
+    Returns the Alpaca TradingClient (paper trading enabled), importing the SDK and creating it on first use.
+    """
+    from alpaca.trading.client import TradingClient
+    return TradingClient(ALPACA_API_KEY, ALPACA_SECRET_KEY, paper=True)
+
+@functools.cache
+def get_gemini_client():
+    """
+    Returns the GeminiClient, importing the Google GenAI SDK and creating it on first use.
+    """
+    from gemini_integration import GeminiClient
+    return GeminiClient(api_key=GOOGLE_GENAI_API_KEY)
 
 def get_portfolio_info():
+    """
+    Fetches the account and open positions from Alpaca.
+    Returns an empty dictionary if they could not be fetched.
+    """
+    trading_client = get_trading_client()
     try:
         account = trading_client.get_account()
         positions = trading_client.get_all_positions()
@@ -64,50 +123,165 @@ def get_portfolio_info():
         }
         return portfolio_info
     except Exception as e:
-        logging.error(f"Error fetching portfolio info: {e}")
+        _logger.error("Error fetching portfolio info: %s", e)
         return {}
 
 def get_relevant_tickers(open_positions, trending_stocks, guaranteed_tickers=['SPY', 'DIA', 'SQQQ', 'TQQQ']):
-    tickers = set()
-    for pos in open_positions:
-        tickers.add(pos["ticker"])
-    for t in trending_stocks:
-        tickers.add(t)
-    for t in guaranteed_tickers:
-        tickers.add(t)
-
-    return list(tickers)[-30:]  # Limit to the last 30 tickers
-
-def get_quote_data(tickers):
-    headers = {"X-Finnhub-Token": FINNHUB_API_KEY}
-    quote_data = {}
-    for ticker in tickers:
-        url = f"https://finnhub.io/api/v1/quote?symbol={ticker}"
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                cur_ticker_data = response.json()  # Expected keys: c, h, l, o, pc, d, dp, t
-
-                # change the key names to be more descriptive
-                quote_data[ticker] = {
-                    "current_price": cur_ticker_data.get("c"),
-                    "high_price": cur_ticker_data.get("h"),
-                    "low_price": cur_ticker_data.get("l"),
-                    "open_price": cur_ticker_data.get("o"),
-                    "prev_close_price": cur_ticker_data.get("pc"),
-                    "daily_change": cur_ticker_data.get("d"),
-                    "daily_percent_change": cur_ticker_data.get("dp"),
-                }
-            else:
-                logging.error(f"Failed to fetch quote for {ticker}: {response.status_code}")
-        except Exception as e:
-            logging.error(f"Error fetching quote for {ticker}: {e}")
+    """
+    Returns up to 30 unique tickers, in a stable order: the open positions first (so they are
+    always included), then the guaranteed tickers, then the trending stocks.
+    """
+    tickers = dict.fromkeys(pos["ticker"] for pos in open_positions)
+    tickers.update(dict.fromkeys(guaranteed_tickers))
+    tickers.update(dict.fromkeys(trending_stocks))
+
+    return list(tickers)[:30]  # Limit to the first 30 tickers
+
+# Regular US market hours, used if the market status can't be fetched
+MARKET_TIMEZONE = ZoneInfo("America/New_York")
+MARKET_OPEN_TIME = datetime.time(9, 30)
+MARKET_CLOSE_TIME = datetime.time(16, 0)
+
+def is_within_market_hours(now=None):
+    """
+    Returns True if it is a weekday between the regular market open and close (US Eastern time).
+    Holidays are not accounted for.
+    """
+    now = now or datetime.datetime.now(MARKET_TIMEZONE)
+    return now.weekday() < 5 and MARKET_OPEN_TIME <= now.time() < MARKET_CLOSE_TIME
+
+def is_market_open():
+    """
+    Checks the US market status with Finnhub.
+    If the status can't be fetched, falls back to the regular market hours.
+    """
+    url = f"https://finnhub.io/api/v1/stock/market-status?exchange=US"
+    try:
+        finnhub_limiter.acquire()
+        response = finnhub_session.get(url, timeout=FINNHUB_TIMEOUT)
+        if response.status_code == 200:
+            market_status = orjson.loads(response.content)
+
+            not_post_market = True
+            # not_post_market = market_status.get("session", "") != "post-market"
+
+            market_open = not (market_status.get("isOpen", True) == False and not_post_market)
+            return market_open
+            
+        else:
+            _logger.error("Failed to fetch market status: %s", response.status_code)
+    except Exception as e:
+        _logger.error("Error fetching market status: %s", e)
+    return is_within_market_hours()
+
+# Order statuses after which an order no longer holds any shares
+_CLOSED_ORDER_STATUSES = {"canceled", "filled", "expired", "rejected", "replaced", "done_for_day"}
+
+def wait_for_orders_closed(order_ids, timeout=CANCEL_WAIT_TIMEOUT):
+    """
+    Polls Alpaca until the given orders are closed (e.g. their cancellation has gone through),
+    or until timeout seconds have passed. Returns True if all of them closed in time.
+    """
+    trading_client = get_trading_client()
+    pending = set(order_ids)
+    deadline = time.monotonic() + timeout
+    while pending:
+        for order_id in list(pending):
+            try:
+                status = trading_client.get_order_by_id(order_id).status
+            except Exception as e:
+                _logger.error("Error checking the status of order %s: %s", order_id, e)
+                continue
+            if getattr(status, "value", status) in _CLOSED_ORDER_STATUSES:
+                pending.discard(order_id)
+        if not pending or time.monotonic() >= deadline:
+            break
+        time.sleep(CANCEL_POLL_INTERVAL)
+    return not pending
+
+# action -> (order side, direction of the stop loss limit price from its stop price, whether it opens a position)
+_ACTIONS = {
+    "BUY": ("BUY", -1, True),
+    "SHORT": ("SELL", +1, True),
+    "SELL": ("SELL", 0, False),
+    "COVER": ("BUY", 0, False),
+}
+
+# Alpaca's error code for an order needing more shares than are available (i.e. not held by other orders)
+_INSUFFICIENT_QTY_CODE = 40310000
+
+def _api_error_payload(api_err) -> dict:
+    """
+    Returns the JSON body of an Alpaca APIError (code, message, related_orders, ...),
+    or an empty dictionary if it does not have one.
+    """
+    try:
+        payload = orjson.loads(str(api_err))
+    except orjson.JSONDecodeError:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+def _make_bracket_order(ticker, qty, side, stop_loss_value, take_profit_value, sign):
+    """
+    Builds the market bracket order that opens a position, with its take profit and stop loss legs.
+    The stop loss is a stop limit order whose limit is 1% past the stop price, in the direction given by sign.
+    """
+    from alpaca.trading.requests import MarketOrderRequest
+    from alpaca.trading.enums import OrderType, TimeInForce, OrderClass
+
+    stop_loss_value = float(stop_loss_value)
+    limit_loss_price = round(stop_loss_value * (1 + sign * 0.01), 2)
+    return MarketOrderRequest(
+        symbol=ticker,
+        qty=qty,
+        side=side,
+        type=OrderType.MARKET,
+        time_in_force=TimeInForce.GTC,
+        order_class=OrderClass.BRACKET,
+        take_profit={"limit_price": round(float(take_profit_value), 2)},
+        stop_loss={"stop_price": round(stop_loss_value, 2), "limit_price": limit_loss_price}
+    )
+
+def _take_profit_price(order):
+    """
+    Returns the limit price of a bracket's take profit, given the take profit leg itself or its parent order
+    (whose legs hold the take profit and stop loss), or None if neither has one.
+    """
+    from alpaca.trading.enums import OrderType
 
+    for candidate in [order, *(getattr(order, "legs", None) or [])]:
+        if candidate.type == OrderType.LIMIT and candidate.limit_price is not None:
+            return float(candidate.limit_price)
+    return None
 
+class OpenOrdersBySymbol:
+    """
+    All open Alpaca orders grouped by symbol, fetched with a single request the first time they are needed
+    and then shared, e.g. by every trade executed in one cycle.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._orders_by_symbol = None
 
-    return quote_data
+    def get(self, symbol) -> list:
+        with self._lock:
+            if self._orders_by_symbol is None:
+                from alpaca.trading.requests import GetOrdersRequest
+                from alpaca.trading.enums import QueryOrderStatus
+
+                self._orders_by_symbol = {}
+                try:
+                    open_orders = get_trading_client().get_orders(
+                        filter=GetOrdersRequest(status=QueryOrderStatus.OPEN, limit=500)    # the most Alpaca returns at once
+                    )
+                except Exception as e:
+                    _logger.error("Error fetching the open orders: %s", e)
+                    open_orders = []
+                for order in open_orders:
+                    self._orders_by_symbol.setdefault(order.symbol, []).append(order)
+        return self._orders_by_symbol.get(symbol, [])
 
-def execute_trade(order_dict: dict):
+def execute_trade(order_dict: dict, open_orders: OpenOrdersBySymbol = None):
     """
     Places an order using Alpaca's trading_client based on the provided order dictionary.
     
@@ -119,53 +293,41 @@ def execute_trade(order_dict: dict):
             - 'stop_loss' (float): stop loss trigger price (used with BUY/SHORT)
             - 'take_profits_price' (float): take profit limit price (used with BUY/SHORT)
             - 'order_target_price' (float): target price (ignored for BUY/SHORT and SELL/COVER)
+        open_orders (OpenOrdersBySymbol): open orders shared between trades, used if a SELL/COVER
+            conflicts with existing orders. If not given, the ticker's open orders are fetched.
     
     Returns:
         The response from trading_client.submit_order().
     """
+    from alpaca.common.exceptions import APIError
+    from alpaca.trading.requests import MarketOrderRequest, LimitOrderRequest, GetOrdersRequest
+    from alpaca.trading.enums import OrderSide, OrderType, TimeInForce, QueryOrderStatus
+
+    trading_client = get_trading_client()
     ticker = order_dict.get("ticker").upper()
     action = order_dict.get("action", "").upper()
     qty = order_dict.get("quantity")
     
-    # Determine order side.
-    if action in ["BUY", "COVER"]:
-        order_side = OrderSide.BUY
-    elif action in ["SELL", "SHORT"]:
-        order_side = OrderSide.SELL
-    else:
+    # Determine order side, and whether it opens or closes a position.
+    if action not in _ACTIONS:
         raise ValueError("Invalid action. Must be one of: BUY, SELL, SHORT, COVER")
+    side_name, sign, opens_position = _ACTIONS[action]
+    order_side = OrderSide[side_name]
     
-    if action in ["BUY", "SHORT"]:
+    if opens_position:
         # For entry orders (BUY/SHORT), place a bracket order.
-        stop_loss_value = order_dict.get("stop_loss")
-        take_profit_value = order_dict.get("take_profits_price")
-        if action == "SHORT":
-            limit_loss_price = round(stop_loss_value + (stop_loss_value * 0.01), 2)
-        else:
-            limit_loss_price = round(stop_loss_value - (stop_loss_value * 0.01), 2)
-    
-        stop_loss_value = round(stop_loss_value, 2)
-        take_profit_value = round(take_profit_value, 2)
-    
-        bracket_order = MarketOrderRequest(
-            symbol=ticker,
-            qty=qty,
-            side=order_side,
-            type=OrderType.MARKET,
-            time_in_force=TimeInForce.GTC,
-            order_class=OrderClass.BRACKET,
-            take_profit={"limit_price": take_profit_value},
-            stop_loss={"stop_price": stop_loss_value, "limit_price": limit_loss_price}
+        bracket_order = _make_bracket_order(
+            ticker, qty, order_side, order_dict.get("stop_loss"), order_dict.get("take_profits_price"), sign
         )
         try:
             response = trading_client.submit_order(order_data=bracket_order)
-            logging.info(f"Executed trade: {' '.join([f'{k}:{v}' for k, v in order_dict.items()])}")
+            _logger.info("Executed trade: %s", LazyFields(order_dict))
             return response
         except Exception as e:
-            logging.error(f"Error executing trade for {order_dict}: {e}")
+            _logger.error("Error executing trade for %s: %s", order_dict, e)
             return None
 
-    elif action in ["SELL", "COVER"]:
+    else:
 
         # Submit a simple market order for SELL or COVER.
         market_order = MarketOrderRequest(
@@ -177,169 +339,269 @@ def execute_trade(order_dict: dict):
         )
         try:
             response = trading_client.submit_order(order_data=market_order)
-            logging.info(f"Executed trade: {' '.join([f'{k}:{v}' for k, v in order_dict.items()])}")
+            _logger.info("Executed trade: %s", LazyFields(order_dict))
             return response
-        except Exception as e:
-            logging.error(f"Error executing trade for {order_dict}: {e}")
-
-            # turn API error into a dict
-            try:
-                e = json.loads(str(e))
-            except Exception as e:
-                logging.error(f"Error parsing API error: {e}")
+        except APIError as api_err:
+            _logger.error("Error executing trade for %s: %s", order_dict, api_err)
 
-            if e["code"] == 4031000 or e["message"].startswith("insufficient qty available"):
+            # the shares are held by open (bracket) orders
+            error = _api_error_payload(api_err)
+            if error.get("code") == _INSUFFICIENT_QTY_CODE or (error.get("message") or "").startswith("insufficient qty available"):
                 
-                bracket_ids = e["related_orders"]
+                bracket_ids = error.get("related_orders") or []
+                ids_to_cancel = []
                 brackets_to_replace = []        # elems - {"id": id, "qty": qty, "take_profit": take_profit, "order_side": ORDER_SIDE}
                 leftover_qty = qty
 
-                # get the conflicting bracket order
-                for bracket_id in bracket_ids:
-                    if leftover_qty > 0:
+                with ThreadPoolExecutor(max_workers=8) as pool:
 
+                    # get the conflicting bracket orders from the ticker's open orders, fetched with one request
+                    if open_orders is not None:
+                        ticker_orders = open_orders.get(ticker)
+                    else:
                         try:
-                            bracket_order = trading_client.get_order_by_id(bracket_id)
+                            ticker_orders = trading_client.get_orders(
+                                filter=GetOrdersRequest(status=QueryOrderStatus.OPEN, symbols=[ticker])
+                            )
                         except Exception as e:
-                            logging.error(f"Error fetching the conflicted bracket order {bracket_id}: {e}")
+                            _logger.error("Error fetching the open orders for %s: %s", ticker, e)
+                            ticker_orders = []
+                    open_orders_by_id = {str(order.id): order for order in ticker_orders}
+
+                    # (fetching any not listed, e.g. if that request failed, one by one)
+                    def get_bracket_order(bracket_id):
+                        if str(bracket_id) in open_orders_by_id:
+                            return open_orders_by_id[str(bracket_id)]
+                        try:
+                            return trading_client.get_order_by_id(bracket_id)
+                        except Exception as e:
+                            _logger.error("Error fetching the conflicted bracket order %s: %s", bracket_id, e)
+                            return None
+
+                    bracket_orders = list(pool.map(get_bracket_order, bracket_ids))
+
+                    for bracket_id, bracket_order in zip(bracket_ids, bracket_orders):
+                        if leftover_qty <= 0:
+                            break
+                        if bracket_order is None:
                             continue
-                        
+
                         try:
+                            bracket_qty = float(bracket_order.qty)
+                        except Exception as e:
+                            _logger.error("Error reading bracket order %s: %s", bracket_id, e)
+                            continue
 
-                            bracket_order.qty = float(bracket_order.qty)
+                        # check the quantity of this bracket order
+                        # if it's less than the leftover quantity, cancel it and subtract from leftover_qty
+                        # if it's more than the leftover quantity, cancel it and re-establish the bracket order for the remaining shares
+                        if bracket_qty > leftover_qty:
 
-                            # check the quantity of this bracket order
-                            # if it's less than the leftover quantity, cancel it and subtract from leftover_qty
-                            # if it's more than the leftover quantity, cancel it and re-establish the bracket order for the remaining shares
-                            if bracket_order.qty <= leftover_qty:
-                                cancel_resp = trading_client.cancel_order_by_id(bracket_id)
-                                leftover_qty -= bracket_order.qty
-                                logging.info(f"Canceled bracket order {bracket_id} for {ticker} of qty {bracket_order.qty} - remaining qty: {leftover_qty}")
-                            else:
+                            # TODO: Only conflict with take profits orders - not stop loss orders
+                            # replace jus the take profits order
 
-                                # TODO: Only conflict with take profits orders - not stop loss orders
-                                # replace jus the take profits order
-                                
-                                order_to_replace = {
+                            take_profit = _take_profit_price(bracket_order)
+                            if take_profit is None:
+                                _logger.warning("No take profit price on bracket order %s, so it won't be re-established", bracket_id)
+                            else:
+                                brackets_to_replace.append({
                                     "id": bracket_id,
-                                    "qty": bracket_order.qty - leftover_qty,
-                                    "take_profit": bracket_order.take_profit["limit_price"],
+                                    "qty": bracket_qty - leftover_qty,
+                                    "take_profit": take_profit,
                                     "order_side": bracket_order.side
-                                }
-                                brackets_to_replace.append(order_to_replace)
+                                })
+                        ids_to_cancel.append((bracket_id, bracket_qty))
+                        leftover_qty = max(leftover_qty - bracket_qty, 0)
 
-                                cancel_resp = trading_client.cancel_order_by_id(bracket_id)
-                                leftover_qty = 0
-                                logging.info(f"Canceled bracket order {bracket_id} for {ticker} of qty {bracket_order.qty} - remaining qty: {leftover_qty}")
+                    # cancel them, all at once
+                    def cancel_bracket_order(to_cancel):
+                        bracket_id, bracket_qty = to_cancel
+                        try:
+                            trading_client.cancel_order_by_id(bracket_id)
+                            _logger.info("Canceled bracket order %s for %s of qty %s", bracket_id, ticker, bracket_qty)
+                            return bracket_id
                         except Exception as e:
-                            logging.error(f"Error canceling bracket order {bracket_id}: {e}")
+                            _logger.error("Error canceling bracket order %s: %s", bracket_id, e)
+                            return None
 
-                # Now, retry the cover/sell order
-                second_response = None
-                # wait to make sure the order is canceled fully
-                time.sleep(2)
-                try:
-                    second_response = trading_client.submit_order(order_data=market_order)
-                    logging.info(f"2nd try - Executed trade: {' '.join([f'{k}:{v}' for k, v in order_dict.items()])}")
-                except Exception as e:
-                    logging.error(f"2nd try error executing trade for {order_dict}: {e}")
+                    canceled_ids = [bracket_id for bracket_id in pool.map(cancel_bracket_order, ids_to_cancel) if bracket_id]
 
-                # Re-establish bracket orders for the remaining shares
-                for bracket in brackets_to_replace:
+                    # Now, retry the cover/sell order
+                    second_response = None
+                    # wait to make sure the orders are canceled fully
+                    if not wait_for_orders_closed(canceled_ids):
+                        _logger.warning("Canceled orders for %s did not close within %ss", ticker, CANCEL_WAIT_TIMEOUT)
                     try:
-                        retry_order = MarketOrderRequest(
+                        second_response = trading_client.submit_order(order_data=market_order)
+                        _logger.info("2nd try - Executed trade: %s", LazyFields(order_dict))
+                    except Exception as e:
+                        _logger.error("2nd try error executing trade for %s: %s", order_dict, e)
+
+                    # Re-establish the take profit orders for the remaining shares, all at once
+                    def replace_bracket_order(bracket):
+                        retry_order = LimitOrderRequest(
                             symbol=ticker,
                             qty=bracket["qty"],
                             side=bracket["order_side"],
-                            type=OrderType.MARKET,
+                            type=OrderType.LIMIT,
                             time_in_force=TimeInForce.GTC,
-                            take_profit={"limit_price": bracket["take_profit"]},
+                            limit_price=bracket["take_profit"],
                         )
-                        retry_response = trading_client.submit_order(order_data=market_order)
-                        logging.info(f"Re-established TPO trade: {' '.join([f'{k}:{v}' for k, v in retry_response.items()])}")
-                    except Exception as e:
-                        logging.error(f"Error re-establishing the trade for {retry_order}: {e}")
+                        try:
+                            trading_client.submit_order(order_data=retry_order)
+                            _logger.info("Re-established TPO trade for %s: qty:%s limit_price:%s", ticker, bracket['qty'], bracket['take_profit'])
+                        except Exception as e:
+                            _logger.error("Error re-establishing the trade for %s: %s", retry_order, e)
 
+                    # (only once the order went through - otherwise the shares are still free to hold the original orders)
+                    if second_response is not None:
+                        list(pool.map(replace_bracket_order, brackets_to_replace))
 
                 return second_response
 
 
             return None
+        except Exception as e:
+            _logger.error("Error executing trade for %s: %s", order_dict, e)
+            return None
 
 
-def main():
-
-    # Check the market is open
-    headers = {"X-Finnhub-Token": FINNHUB_API_KEY}
-    url = f"https://finnhub.io/api/v1/stock/market-status?exchange=US"
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            market_status = response.json()  
-
-            not_post_market = True
-            # not_post_market = market_status.get("session", "") != "post-market"
+async def execute_trades(trades):
+    """
+    Executes the trades via Alpaca concurrently, with at most TRADE_EXECUTION_CONCURRENCY tickers at once.
+    Trades for the same ticker are executed one after another, in the order given.
+    A failing trade is logged and does not stop the others.
+    Returns the number of trades that were submitted successfully.
+    """
+    trades_by_ticker = {}
+    for trade in trades:
+        trades_by_ticker.setdefault(trade.get("ticker", "").upper(), []).append(trade)
+
+    slots = asyncio.Semaphore(TRADE_EXECUTION_CONCURRENCY)
+    # only fetched if a trade needs them, then shared by all of them
+    open_orders = OpenOrdersBySymbol()
+
+    async def execute_ticker_trades(ticker_trades):
+        submitted = 0
+        async with slots:
+            for trade in ticker_trades:
+                try:
+                    if await asyncio.to_thread(execute_trade, trade, open_orders) is not None:
+                        submitted += 1
+                    # _logger.info("Executed trade: %s", LazyFields(trade))
+                except Exception as e:
+                    _logger.error("Generic uncaught error executing trade %s: %s", trade, e)
+        return submitted
 
-            if market_status.get("isOpen", True) == False and not_post_market:
-                logging.info("Market is closed. Exiting.")
-                return
-            
-    except Exception as e:
-        logging.error(f"Error fetching market status: {e}")
+    return sum(await asyncio.gather(*(execute_ticker_trades(ticker_trades) for ticker_trades in trades_by_ticker.values())))
 
 
+async def main():
 
-    # 1. Retrieve trending stocks via Gemini.
-    trending_stocks = gemini_client.get_trending_stocks()
-    logging.info("Trending Stocks: " + str(trending_stocks))
+    # Check the market is open before anything else, so a closed market
+    # costs neither a Gemini call nor the SDK imports
+    if not await asyncio.to_thread(is_market_open):
+        _logger.info("Market is closed. Exiting.")
+        return
 
-    # 2. Fetch portfolio information from Alpaca.
-    portfolio_info = get_portfolio_info()
-    logging.info("Portfolio Info: " + json.dumps(portfolio_info, indent=2))
+    from gemini_integration import TradeStreamParser, market_signature
+    gemini_client = get_gemini_client()
 
-    # 3. Form a list of relevant tickers (open positions + trending stocks).
+    # 1. Retrieve trending stocks via Gemini,
+    # 2. fetch portfolio information from Alpaca, and
+    # 3. retrieve the last 5 Gemini responses for context, all at once.
+    how_many_to_get = 5
+    trending_stocks, portfolio_info, history = await asyncio.gather(
+        gemini_client.aget_trending_stocks(),
+        asyncio.to_thread(get_portfolio_info),
+        gemini_client.aget_last_history(how_many_to_get),
+        return_exceptions=True,
+    )
+    # Carry on without whichever of them failed (the guaranteed tickers are still quoted)
+    if isinstance(trending_stocks, Exception):
+        _logger.error("Error retrieving trending stocks: %s", trending_stocks)
+        trending_stocks = []
+    if isinstance(portfolio_info, Exception):
+        _logger.error("Error fetching portfolio info: %s", portfolio_info)
+        portfolio_info = {}
+    if isinstance(history, Exception):
+        _logger.error("Error retrieving history: %s", history)
+        history = ([], [])
+    last_history, history_times = history
+    _logger.info("Trending Stocks: %s", trending_stocks)
+    _logger.info("Portfolio Info: %s", LazyJson(portfolio_info))
+
+    # 4. Form a list of relevant tickers (open positions + trending stocks).
     open_positions = portfolio_info.get("positions", [])
     relevant_tickers = get_relevant_tickers(open_positions, trending_stocks)
-    logging.info("Relevant Tickers: " + str(relevant_tickers))
+    _logger.info("Relevant Tickers: %s", relevant_tickers)
 
-    # 4. Fetch market quotes for these tickers using Finnhub.
-    quote_data = get_quote_data(relevant_tickers)
-    # logging.info("Quote Data: " + json.dumps(quote_data, indent=2))
+    # 5. Fetch market quotes for these tickers using Finnhub.
+    quote_data = await asyncio.to_thread(get_quote_data, relevant_tickers)
+    _logger.debug("Quote Data: %s", LazyJson(quote_data))
 
-    # 5. Retrieve the last 5 Gemini responses for context.
-    how_many_to_get = 5
-    last_history, history_times = gemini_client.get_last_history(how_many_to_get)
-    previous_plan = ""
+    # Skip Gemini if neither the positions nor the prices have materially changed since the last plan.
+    # Its trades have already been placed, so nothing is executed either.
+    signature = market_signature(portfolio_info, quote_data)
+    if gemini_client.is_plan_current(signature):
+        _logger.info("Market is unchanged since the last plan. Skipping Gemini.")
+        return
+
+    previous_plan_parts = []
     for idx, history in enumerate(last_history):
         if history_times[idx] == 'w':
-            previous_plan += f"Summary of plan from last week before close: \n{history}\n"
+            previous_plan_parts.append(f"Summary of plan from last week before close: \n{history}\n")
         elif history_times[idx] == 'd':
-            previous_plan += f"Summary of plan from yesterday before close: \n{history}\n"
+            previous_plan_parts.append(f"Summary of plan from yesterday before close: \n{history}\n")
         else:
-            previous_plan += f"Summary of plan from {(how_many_to_get - idx) * 5} minutes ago: \n{history}\n"
+            previous_plan_parts.append(f"Summary of plan from {(how_many_to_get - idx) * 5} minutes ago: \n{history}\n")
+    previous_plan = "".join(previous_plan_parts)
 
     # 6. Build the Gemini prompt.
     gemini_prompt = gemini_client.build_prompt(portfolio_info, quote_data, previous_plan)
 
-    # 7. Call Gemini to get the proposed trade actions.
-    gemini_response = gemini_client.call_gemini(gemini_prompt)
-    gemini_client.save_history(gemini_response)
-
-    # 8. Parse the Gemini response.
-    trades = gemini_client.parse_response(gemini_response)
-    logging.info("Parsed Trade Actions: " + json.dumps(trades, indent=2))
+    # 7. Call Gemini to get the proposed trade actions, and
+    # 8. parse the trades from the response as it is streamed.
+    trade_parser = TradeStreamParser()
+    trades = []
+    response_chunks = []
+    quote_fetches = []
+
+    def add_trades(new_trades):
+        # Trades with neither a quote nor a target price need their price looked up during validation,
+        # so fetch those quotes as soon as the trade is parsed, while Gemini is still generating
+        missing = missing_price_tickers(new_trades, quote_data, portfolio_info)
+        if missing:
+            quote_fetches.append(asyncio.create_task(asyncio.to_thread(get_quote_data, missing)))
+        trades.extend(new_trades)
+
+    async for chunk in gemini_client.acall_gemini_stream(gemini_prompt):
+        response_chunks.append(chunk)
+        add_trades(trade_parser.feed(chunk))
+    add_trades(trade_parser.close())
+
+    for fetched_quotes in await asyncio.gather(*quote_fetches):
+        quote_data.update(fetched_quotes)
+
+    gemini_response = "".join(response_chunks)
+    # (an empty response has no plan to keep - it would be stored as an empty entry)
+    if gemini_response:
+        gemini_client.save_history(gemini_response)
+    _logger.info("Parsed Trade Actions: %s", LazyJson(trades))
 
     # 9. Validate the trade actions.
-    valid_trades = validate_trades(trades, quote_data, portfolio_info, FINNHUB_API_KEY)
-    logging.info("Valid Trade Actions: " + json.dumps(valid_trades, indent=2))
+    valid_trades = validate_trades(trades, quote_data, portfolio_info)
+    _logger.info("Valid Trade Actions: %s", LazyJson(valid_trades))
 
-    # 10. Execute each valid trade via Alpaca.
-    for trade in valid_trades:
-        try:
-            execute_trade(trade)
-            # logging.info(f"Executed trade: {' '.join([f'{k}:{v}' for k, v in trade.items()])}")
-        except Exception as e:
-            logging.error(f"Generic uncaught error executing trade {trade}: {e}")
+    # 10. Execute the valid trades via Alpaca.
+    submitted = await execute_trades(valid_trades)
+    # The plan is only current once its orders are in (or it had none), as the gate assumes
+    # the positions already reflect it - if every order failed, ask Gemini again next run
+    if gemini_response and (submitted or not valid_trades):
+        gemini_client.remember_plan(signature)
+
+    # 11. Make sure the plan has been summarized and saved to history before exiting.
+    await asyncio.to_thread(gemini_client.flush_history)
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
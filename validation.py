@@ -1,76 +1,151 @@
-import requests
-import logging
+import math
+import re
+from market_data import get_quote_data
 
-def validate_trades(trades, quote_data, portfolio_info, FINNHUB_API_KEY):
+# A whole number of shares given as text, e.g. "10" or "-5"
+_QUANTITY_RE = re.compile(r"-?[0-9]+")
+
+# action -> (multiple of the current price bounding the stop loss, whether that bound is a floor)
+# For buys, the stop loss should not be set lower than 70% of the current price;
+# for sells/shorts, it should not be set higher than 130% of the current price.
+_STOP_LOSS_BOUNDS = {
+    "BUY": (0.7, True),
+    "COVER": (0.7, True),
+    "SELL": (1.3, False),
+    "SHORT": (1.3, False),
+}
+
+def _parse_quantity(quantity):
+    """
+    Returns the trade quantity as a whole number of shares, or None if it is not a finite number.
+    """
+    if isinstance(quantity, bool):
+        return None
+    if isinstance(quantity, int):
+        return quantity
+    if isinstance(quantity, float):
+        return int(quantity) if math.isfinite(quantity) else None
+    if isinstance(quantity, str) and _QUANTITY_RE.fullmatch(quantity.strip()):
+        return int(quantity)
+    return None
+
+def _offsets_position(action, position_qty):
+    """
+    Whether the action trades against the position held in its ticker (e.g. selling a long position),
+    in which case it is automatically valid.
+    """
+    if action in ("SELL", "SHORT"):
+        return position_qty >= 0
+    if action == "COVER":
+        return position_qty < 0
+    if action == "BUY":
+        return position_qty <= 0
+    return False
+
+def _get_positions(portfolio_info):
+    """
+    Returns the quantity held of each ticker in the portfolio (negative for short positions).
+    """
+    positions = {}
+    for position in portfolio_info.get("positions", []):
+        ticker = position.get("ticker", "").upper()
+        if not ticker:
+            continue
+        try:
+            # Positive quantity means long position, negative means short position
+            positions[ticker] = float(position.get("qty", 0))
+        except Exception:
+            # an unreadable quantity is not treated as a position, so its trades get the full checks
+            continue
+    return positions
+
+def _needs_price(ticker, action, trade, positions):
+    """
+    Whether validating the trade gets as far as pricing it, rather than accepting or rejecting it
+    on its position and quantity alone.
+    """
+    position_qty = positions.get(ticker, 0)
+    if ticker in positions and _offsets_position(action, position_qty):
+        return False
+    if _parse_quantity(trade.get("quantity")) is None:
+        return False
+    if action == "SELL":
+        return position_qty > 0
+    if action == "COVER":
+        return position_qty < 0
+    return True
+
+def _missing_price_tickers(keyed_trades, quote_data, positions):
+    """
+    Returns the tickers of the ((ticker, action), trade) pairs that need a price, but have neither a quote
+    nor a target price.
+    """
+    return list(dict.fromkeys(
+        ticker for (ticker, action), trade in keyed_trades
+        if ticker not in quote_data and trade.get("order_target_price", None) is None
+        and _needs_price(ticker, action, trade, positions)
+    ))
+
+def missing_price_tickers(trades, quote_data, portfolio_info):
+    """
+    Returns the tickers that validate_trades will have to fetch a quote for, so that they can be fetched
+    ahead of validation. Trades it rejects or accepts before pricing them are left out.
+    """
+    keyed_trades = (
+        ((trade.get("ticker"), trade.get("action", "").upper()), trade) for trade in trades
+        if trade.get("ticker") and trade.get("action")
+    )
+    return _missing_price_tickers(keyed_trades, quote_data, _get_positions(portfolio_info))
+
+def validate_trades(trades, quote_data, portfolio_info):
     """
     Validates each trade action.
     
-    - For BUY/COVER orders: the stop loss must be at least 80% of the current price.
-    - For SELL/SHORT orders: the stop loss must be no more than 120% of the current price.
+    - For BUY/COVER orders: the stop loss must be at least 70% of the current price.
+    - For SELL/SHORT orders: the stop loss must be no more than 130% of the current price.
     - Adjusts the stop loss if it is missing or set incorrectly.
-    - Ensures that the order value does not exceed 70% of the total portfolio equity.
+    - Ensures that the order value does not exceed the buying power.
     - Validates SELL/COVER actions against existing positions.
     - Removes duplicate ticker/action pairs, keeping only the last one.
     
     Returns a list of validated (or adjusted) trade actions.
     """
+    # Get current positions from portfolio info
+    positions = _get_positions(portfolio_info)
+    
     # First, handle duplicate trades by keeping only the last one for each ticker/action pair
     unique_trades = {}
     for trade in trades:
         ticker = trade.get("ticker")
         action = trade.get("action", "").upper()
         if ticker and action:
-            key = f"{ticker}_{action}"
-            unique_trades[key] = trade
-    
-    # Get current positions from portfolio info
-    positions = {}
-    for position in portfolio_info.get("positions", []):
-        ticker = position.get("ticker", "").upper()
-        qty = float(position.get("qty", 0))
-        if ticker:
-            # Positive quantity means long position, negative means short position
-            positions[ticker] = qty
+            unique_trades[(ticker, action)] = trade
     
-    valid_trades = []
-    try:
-        account_value = float(portfolio_info.get("account_value", 1000))
-    except Exception:
-        account_value = 0
+    # Fetch the prices of the tickers with neither a quote nor a target price up front, all at once
+    # (only for trades that get as far as pricing - e.g. trades against a held position are valid as they are)
+    fetched_quotes = get_quote_data(_missing_price_tickers(unique_trades.items(), quote_data, positions))
 
+    valid_trades = []
     try:
         buying_power = float(portfolio_info.get("buying_power", 0))
     except Exception:
         buying_power = 0
 
-    open_positions = {x.get("ticker", ""):x for x in portfolio_info.get("positions", [])}
-
     # Process the unique trades
-    for trade in unique_trades.values():
-        ticker = trade.get("ticker")
-        action = trade.get("action", "").upper()
-        quantity = trade.get("quantity")
-
+    for (ticker, action), trade in unique_trades.items():
         # check if the ticker is in our portfolio
-        if ticker in open_positions.keys():
-            # if the action cancels the position, it is automatically valid
-            if action in ["SELL", "SHORT"]:
-                if float(open_positions[ticker].get("qty")) >= 0:
-                    valid_trades.append(trade)
-                    continue
-            elif action in ["COVER"]:
-                if float(open_positions[ticker].get("qty")) < 0:
-                    valid_trades.append(trade)
-                    continue
-            elif action in ["BUY"]:
-                if float(open_positions[ticker].get("qty")) <= 0:
-                    valid_trades.append(trade)
-                    continue
+        # if the action cancels the position, it is automatically valid
+        position_qty = positions.get(ticker, 0)
+        if ticker in positions and _offsets_position(action, position_qty):
+            valid_trades.append(trade)
+            continue
 
+        quantity = _parse_quantity(trade.get("quantity"))
+        if quantity is None:
+            continue
 
         # Check if SELL/COVER actions have corresponding positions
         if action == "SELL":
-            position_qty = positions.get(ticker, 0)
             if position_qty <= 0:  # No long position to sell
                 continue
             # Limit quantity to available position size
@@ -79,7 +154,6 @@ def validate_trades(trades, quote_data, portfolio_info, FINNHUB_API_KEY):
                 trade["quantity"] = quantity
         
         elif action == "COVER":
-            position_qty = positions.get(ticker, 0)
             if position_qty >= 0:  # No short position to cover
                 continue
             # Limit quantity to available short position size (shorts are negative)
@@ -87,30 +161,17 @@ def validate_trades(trades, quote_data, portfolio_info, FINNHUB_API_KEY):
                 quantity = int(abs(position_qty))
                 trade["quantity"] = quantity
 
+        # (quotes missing from the quote data were queried from the API above)
+        quote = quote_data.get(ticker) or fetched_quotes.get(ticker)
+        target_price = trade.get("order_target_price")
         try:
-            if ticker not in quote_data and trade.get("order_target_price", None) is not None:
+            if quote is not None:
+                current_price = float(quote.get("current_price"))
+            elif target_price is not None:
                 # Use the order target price if available
-                current_price = float(trade.get("order_target_price"))
+                current_price = float(target_price)
             else:
-                if ticker in quote_data:
-                    current_price = float(quote_data[ticker].get("current_price"))
-                else:
-                    # query the price from the API
-                    headers = {"X-Finnhub-Token": FINNHUB_API_KEY}
-                    url = f"https://finnhub.io/api/v1/quote?symbol={ticker}"
-                    try:
-                        response = requests.get(url, headers=headers)
-                        if response.status_code == 200:
-                            cur_ticker_data = response.json()  # Expected keys: c, h, l, o, pc, d, dp, t
-                            current_price = cur_ticker_data.get("c")
-                        else:
-                            logging.error(f"Error fetching data for {ticker}: {response.status_code}")
-                            continue
-                    except Exception as e:
-                        logging.error(f"Error fetching data for {ticker}: {e}")
-                        continue
-
-            quantity = int(quantity)
+                continue
         except Exception:
             continue
 
@@ -120,15 +181,11 @@ def validate_trades(trades, quote_data, portfolio_info, FINNHUB_API_KEY):
 
         # Check and adjust stop loss based on action type.
         stop_loss = trade.get("stop_loss")
-        if action in ["BUY", "COVER"]:
-            # For buys, stop loss should not be set lower than 70% of current price.
-            min_stop = current_price * 0.7
-            if stop_loss is None or stop_loss < min_stop:
-                trade["stop_loss"] = round(min_stop, 2)
-        elif action in ["SELL", "SHORT"]:
-            # For sells/shorts, stop loss should not be set higher than 130% of current price.
-            max_stop = current_price * 1.3
-            if stop_loss is None or stop_loss > max_stop:
-                trade["stop_loss"] = round(max_stop, 2)
+        bound = _STOP_LOSS_BOUNDS.get(action)
+        if bound is not None:
+            multiplier, is_floor = bound
+            limit = current_price * multiplier
+            if stop_loss is None or (stop_loss < limit if is_floor else stop_loss > limit):
+                trade["stop_loss"] = round(limit, 2)
         valid_trades.append(trade)
     return valid_trades